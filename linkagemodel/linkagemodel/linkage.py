@@ -1,8 +1,52 @@
+import concurrent.futures
+
+from mpi4py import MPI
 import numpy as np
-from scipy.interpolate import griddata
+from scipy.interpolate import RegularGridInterpolator
 from scipy.ndimage.filters import gaussian_filter
+from scipy.signal import fftconvolve
+from scipy.spatial import Delaunay
 import underworld as uw
 
+# numba is optional; when it's available we use a fused particle
+# classification kernel instead of the plain numpy one
+try:
+    import numba
+except ImportError:
+    numba = None
+
+if numba is not None and not hasattr(numba, 'prange'):
+    # numba predating 0.34 imports fine but has no prange/parallel target
+    # (the docker-base image pins 0.23.1); treat it as absent and keep the
+    # numpy path
+    numba = None
+
+# Thread pool used to run independent numpy/scipy work (which releases the
+# GIL) on separate cores
+_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=3)
+
+if numba is not None:
+    @numba.njit(parallel=True)
+    def _classify_particles(mat, particle_z, surface_z, air_materials, sed_materials, air_index, sed_index):
+        # Fused equivalent of _update_material_types' mask operations: one
+        # parallel pass over the particles with no boolean temporaries.
+        # No fastmath here: surface_z is nan outside the surface, and we
+        # rely on particle_z < nan being False (out-of-domain means air).
+        for i in numba.prange(mat.shape[0]):
+            m = mat[i]
+            if particle_z[i] < surface_z[i]:
+                # below the surface; convert air to sediment
+                for a in air_materials:
+                    if m == a:
+                        mat[i] = sed_index
+                        break
+            else:
+                # above the surface; convert sediment to air
+                for s in sed_materials:
+                    if m == s:
+                        mat[i] = air_index
+                        break
+
 
 class LinkageModel(object):
     """
@@ -94,7 +138,6 @@ class LinkageModel(object):
 
         self.time_years = 0.  # Simulation time in years. We start at year 0.
         self._model_started = False  # Have we performed one-time initialisation yet?
-        self._disp_inserted = False
 
         self.SECONDS_PER_YEAR = float(365 * 24 * 60 * 60)
         self._checkpoint_number = 0  # used to give each checkpoint a unique index
@@ -105,8 +148,35 @@ class LinkageModel(object):
         # to ensure that BL and UW do not desync after many timesteps.
         self.disable_material_changes = False
 
+        # Cached Delaunay triangulation of the Badlands TIN. The TIN topology
+        # is stable across timesteps, so we only rebuild this when the vertex
+        # array changes; only the elevation values change each tick.
+        self._tin_tri = None
+        self._tin_tri_vertices = None
+
+        # Cached axes of the regular Badlands DEM grid, used for the fast
+        # regular-grid interpolation path in _determine_particle_state
+        self._dem_grid_axes = None
+
+        # Particle X/Y positions snapshotted while Badlands runs, consumed
+        # by the next surface interpolation
+        self._particle_xy = None
+
+        # Cached 2D Gaussian kernel for the FFT smoothing path
+        self._gauss_kernel = None
+        self._gauss_kernel_sigma = None
+
+        # Array forms of material_map and the membership lookup tables,
+        # built once the map is final (at startup / first use)
+        self._air_materials = None
+        self._sed_materials = None
+        self._is_air = None
+        self._is_sed = None
+
         self.np_mesh = None  # Non-partitioned copy of 'mesh', configured during model startup
 
+        self._comm = MPI.COMM_WORLD
+
     def run_for_years(self, years, sigma=0):
         """
         Run the model for a number of years. Possibility to smooth Underworld velocity
@@ -135,42 +205,55 @@ class LinkageModel(object):
 
             dt_years = dt_seconds / self.SECONDS_PER_YEAR
 
-            # Advect the Badlands interface surface
-            self._surface_advector.integrate(dt_seconds)
-
             # Synchronise the velocity field across nodes
-            # Each CPU saves its view of the velocity field so it can be reconstructed everywhere
-            # TODO: probably better to not use fixed tempfile names here
-            self.mesh.save('/tmp/mpi-mesh.h5')
-            self.velocity_field.save('/tmp/mpi-velfield.h5')
-            self._surface_tracers.save('/tmp/mpi-surface.h5')
-
-            # load previous mesh coordinate data onto new non-partitioned mesh
-            self.np_mesh.load('/tmp/mpi-mesh.h5')
-
-            # TODO: can probably reuse this too
-            np_velocity_field = uw.mesh.MeshVariable(mesh=self.np_mesh, nodeDofCount=self.np_mesh.dim)
-            np_velocity_field.load('/tmp/mpi-velfield.h5')
+            # Each CPU gathers the other ranks' parts of the velocity field
+            # onto the non-partitioned mesh so the full field can be
+            # evaluated everywhere. This used to be done by saving and
+            # re-loading HDF5 tempfiles, which cost three parallel write+read
+            # cycles per timestep.
+            np_velocity_field = self._np_velocity_field
+            self._gather_velocity_field()
 
-            np_surface_tracers = uw.swarm.Swarm(self.np_mesh)
-            np_surface_tracers.load('/tmp/mpi-surface.h5')
-            # np_surface contains the tracers across all nodes
+            # Gather the surface tracers from all ranks, in DEM node order
+            tracer_coords = self._gather_surface_tracers()
 
             # the entire velocity vector on each particle in METERS PER SECOND
-            tracer_velocity_mps = np_velocity_field.evaluate(np_surface_tracers)
+            tracer_velocity_mps = np_velocity_field.evaluate(tracer_coords)
 
 
             ### INTERFACE PART 1: UW->BL
             # Use the tracer vertical velocities to deform the Badlands TIN
-            # convert from meters per second to meters displacement over the whole iteration
-            tracer_disp = tracer_velocity_mps * self.SECONDS_PER_YEAR * dt_years
+            # convert from meters per second to meters displacement over the
+            # whole iteration. The multiply only depends on the gathered
+            # velocities, so run it on the pool while the advector integrates.
+            # The displacements are only a coarse forcing for Badlands, so the
+            # buffer is built in single precision; the advection path above
+            # stays in double precision.
+            disp_future = _POOL.submit(np.multiply, tracer_velocity_mps,
+                                       self.SECONDS_PER_YEAR * dt_years,
+                                       out=self._tracer_disp, dtype=np.float32)
+
+            # Advect the Badlands interface surface
+            self._surface_advector.integrate(dt_seconds)
+
+            tracer_disp = disp_future.result()
             if sigma == 0:
                 self._inject_badlands_displacement(self.time_years, dt_years, tracer_disp)
             else:
                 self._inject_badlands_displacement_smooth(self.time_years, dt_years, tracer_disp, sigma)
 
-            # Run the Badlands model to the same time point
-            self.badlands_model.run_to_time(self.time_years + dt_years)
+            # Run the Badlands model to the same time point. The surface
+            # process step doesn't touch Underworld state, so run it on the
+            # pool and overlap it with Underworld-side work that doesn't
+            # depend on the new surface.
+            bl_future = _POOL.submit(self.badlands_model.run_to_time, self.time_years + dt_years)
+
+            # while Badlands runs, snapshot the particle X/Y positions that
+            # the surface interpolation will query
+            self._particle_xy = np.ascontiguousarray(self.swarm.particleCoordinates.data[:, :2])
+
+            # wait for the new Badlands surface
+            bl_future.result()
 
 
             ### INTERFACE PART 2: BL->UW
@@ -209,16 +292,18 @@ class LinkageModel(object):
         Note that the initial elevation of the Badlands surface should coincide
         with the material transition in Underworld.
         """
-        items = []
-        # FIXME: there should be a fast numpy way to do this
-        for y in np.linspace(minCoord[0], maxCoord[0], resolution[0]):
-            for x in np.linspace(minCoord[1], maxCoord[1], resolution[1]):
-                items.append([x, y, elevation])
+        ys = np.linspace(minCoord[0], maxCoord[0], resolution[0])
+        xs = np.linspace(minCoord[1], maxCoord[1], resolution[1])
 
         # NOTE: Badlands uses the difference in X coord of the first two points to determine the resolution.
         # This is something we should fix.
-        # This is why we loop in y/x order instead of x/y order.
-        return np.array(items)
+        # This is why we iterate in y/x order instead of x/y order (y on the
+        # outer axis, so x varies fastest).
+        Y, X = np.meshgrid(ys, xs, indexing='ij')
+        Z = np.full(X.shape, elevation)
+        # column-major, so each coordinate column is contiguous for
+        # Badlands' per-column reads
+        return np.asfortranarray(np.column_stack((X.ravel(), Y.ravel(), Z.ravel())))
 
     def _startup(self):
         """
@@ -246,11 +331,33 @@ class LinkageModel(object):
         # ensure BL and UW are synced
         self.badlands_model.input.tDisplay = self.checkpoint_interval
 
+        # Insert the displacement schedule row up front; the injection
+        # functions then just rewrite its two time entries each tick instead
+        # of growing the table
+        self.badlands_model.force.T_disp = np.vstack(([0.0, 0.0], self.badlands_model.force.T_disp))
+
+        # None of these factors change after startup
+        # TODO: what does merge3d do? Can it be removed?
+        self.badlands_model.force.merge3d = self.badlands_model.input.Afactor * self.badlands_model.recGrid.resEdges * 0.5
+
         # create tracers used to track movement of the Badlands surface
         bl_tracers = uw.swarm.Swarm(self.mesh)
         rg = self.badlands_model.recGrid
         dem_coords = np.column_stack((rg.rectX, rg.rectY, rg.rectZ))
-        bl_tracers.add_particles_with_coordinates(dem_coords)
+        local_ids = bl_tracers.add_particles_with_coordinates(dem_coords)
+
+        # Each tracer corresponds to one DEM node. Remember which one, so
+        # that when the tracers are gathered from all ranks we can put them
+        # back into DEM node order.
+        self._tracer_dem_index = bl_tracers.add_variable(dataType="int", count=1)
+        in_domain = local_ids >= 0
+        self._tracer_dem_index.data[local_ids[in_domain], 0] = np.nonzero(in_domain)[0]
+        self._dem_coords = dem_coords
+
+        # Persistent displacement buffer, written by the per-tick multiply.
+        # Allocating it C-contiguous once means the (rnx, rny, 3) reshape in
+        # the smoothing path is always a free view.
+        self._tracer_disp = np.empty((dem_coords.shape[0], 3), dtype=np.float32)
 
         self._surface_advector = uw.systems.SwarmAdvector(swarm=bl_tracers, velocityField=self.velocity_field, order=2)
         self._surface_tracers = bl_tracers
@@ -262,6 +369,46 @@ class LinkageModel(object):
                                                 maxCoord   =self.mesh.maxCoord,
                                                 partitioned=False)
 
+        # Work out, once, which global node each rank's local nodes map to,
+        # so per-node arrays gathered from all ranks can be scattered back
+        # into global node order on the non-partitioned mesh
+        local_gids = np.ascontiguousarray(self.mesh.data_nodegId[:self.mesh.nodesLocal].ravel(), dtype=np.int64)
+        self._node_counts = np.array(self._comm.allgather(local_gids.shape[0]))
+        self._node_displs = np.concatenate(([0], np.cumsum(self._node_counts)[:-1]))
+        self._node_gids = np.empty(self._node_counts.sum(), dtype=np.int64)
+        self._comm.Allgatherv([local_gids, MPI.INT64_T],
+                              [self._node_gids, self._node_counts, self._node_displs, MPI.INT64_T])
+
+        # The mesh topology never changes, so its vertex coordinates only
+        # need to be synchronised once
+        np_mesh_coords = self._gather_node_array(self.mesh.data[:self.mesh.nodesLocal])
+        with self.np_mesh.deform_mesh():
+            self.np_mesh.data[self._node_gids] = np_mesh_coords
+
+        # Non-partitioned mirror of the velocity field, reused every
+        # iteration rather than reallocated
+        self._np_velocity_field = uw.mesh.MeshVariable(mesh=self.np_mesh, nodeDofCount=self.np_mesh.dim)
+
+        # The velocity gather has fixed counts, so it can use an MPI-4
+        # persistent collective where the implementation provides one:
+        # initialise the schedule once, Start/Wait it each tick
+        dim = self.np_mesh.dim
+        self._vel_send = np.empty((self.mesh.nodesLocal, dim))
+        self._vel_recv = np.empty((self._node_counts.sum(), dim))
+        try:
+            self._vel_gather_req = self._comm.Allgatherv_init(
+                [self._vel_send, MPI.DOUBLE],
+                [self._vel_recv, self._node_counts * dim, self._node_displs * dim, MPI.DOUBLE])
+        except (NotImplementedError, AttributeError):
+            # mpi4py < 4 has no Allgatherv_init; newer mpi4py raises
+            # NotImplementedError when the MPI library itself is pre-4.0
+            self._vel_gather_req = None
+
+        # material_map is fixed once the model starts; precompute the array
+        # forms used by _update_material_types
+        self._air_materials = np.asarray(self.material_map[0])
+        self._sed_materials = np.asarray(self.material_map[1])
+
         # Transfer the initial DEM state to Underworld
         self._update_material_types()
 
@@ -278,39 +425,150 @@ class LinkageModel(object):
 
         self._model_started = True
 
+    def _gather_node_array(self, local):
+        """
+        Gather a per-node array from all ranks. The result is in rank order;
+        use self._node_gids to map its rows back to global node ids.
+        """
+        local = np.ascontiguousarray(local, dtype=np.float64)
+        dof = local.shape[1]
+        out = np.empty((self._node_counts.sum(), dof))
+        self._comm.Allgatherv([local, MPI.DOUBLE],
+                              [out, self._node_counts * dof, self._node_displs * dof, MPI.DOUBLE])
+        return out
+
+    def _gather_velocity_field(self):
+        """
+        Gather the local velocity data from all ranks into the
+        non-partitioned velocity field.
+        """
+        self._vel_send[...] = self.velocity_field.data[:self.mesh.nodesLocal]
+        if self._vel_gather_req is not None:
+            self._vel_gather_req.Start()
+            self._vel_gather_req.Wait()
+        else:
+            dim = self.np_mesh.dim
+            self._comm.Allgatherv([self._vel_send, MPI.DOUBLE],
+                                  [self._vel_recv, self._node_counts * dim, self._node_displs * dim, MPI.DOUBLE])
+        self._np_velocity_field.data[self._node_gids] = self._vel_recv
+
+    def _gather_surface_tracers(self):
+        """
+        Gather the surface tracer coordinates from all ranks and return them
+        in DEM node order.
+        """
+        local_coords = self._surface_tracers.particleCoordinates.data
+
+        # fuse the coordinate and DEM index transfers into one collective:
+        # one row of [x, y, z, dem index] per tracer
+        send = np.empty((local_coords.shape[0], 4))
+        send[:, :3] = local_coords
+        send[:, 3] = self._tracer_dem_index.data.ravel()
+
+        # tracers can migrate between ranks, so the counts change every tick
+        counts = np.array(self._comm.allgather(send.shape[0]))
+        displs = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+        recv = np.empty((counts.sum(), 4))
+        self._comm.Allgatherv([send, MPI.DOUBLE],
+                              [recv, counts * 4, displs * 4, MPI.DOUBLE])
+
+        # Tracers which left the domain keep their original DEM position
+        all_index = recv[:, 3].astype(np.int64)
+        coords = np.copy(self._dem_coords)
+        coords[all_index] = recv[:, :3]
+        return coords
+
     def _determine_particle_state(self):
         # Given Badlands' mesh, determine if each particle in 'volume' is above
         # (False) or below (True) it.
 
-        # To do this, for each X/Y pair in 'volume', we interpolate its Z value
-        # relative to the mesh in blModel. Then, if the interpolated Z is
-        # greater than the supplied Z (i.e. Badlands mesh is above particle
-        # elevation) it's sediment (True). Else, it's air (False).
+        # If the interpolated surface Z is greater than the particle Z (i.e.
+        # Badlands mesh is above particle elevation) it's sediment (True).
+        # Else, it's air (False).
+        interpolate_z = self._interpolate_surface()
+
+        # True for sediment, False for air
+        flags = self.swarm.particleCoordinates.data[:, 2] < interpolate_z
+
+        return flags
+
+    def _interpolate_surface(self):
+        # For each particle's X/Y pair, interpolate the Z value of the
+        # Badlands surface at that position.
 
         # TODO: we only support air/sediment layers right now; erodibility
         # layers are not implemented
 
-        known_xy = self.badlands_model.recGrid.tinMesh['vertices']  # points that we have known elevation for
-        known_z = self.badlands_model.elevation  # elevation for those points
+        rg = self.badlands_model.recGrid
+        known_z = self.badlands_model.elevation  # elevation for the known points
 
         volume = self.swarm.particleCoordinates.data
 
-        interpolate_xy = volume[:, [0, 1]]
+        if self._particle_xy is not None:
+            # prefetched while Badlands was running
+            interpolate_xy = self._particle_xy
+            self._particle_xy = None
+        else:
+            # a strided view; fancy-indexing the columns would copy
+            interpolate_xy = volume[:, :2]
         # linear interpolation should be plenty as we're running Badlands at
         # higher resolution than Underworld
-        interpolate_z = griddata(points=known_xy, values=known_z, xi=interpolate_xy, method='linear')
-
-        # True for sediment, False for air
-        flags = volume[:, 2] < interpolate_z
 
-        return flags
+        if known_z.size == rg.rnx * rg.rny:
+            # The elevations are defined on the regular DEM grid, so we can
+            # use a rectilinear interpolator: O(1) per query instead of a
+            # simplex search over the unstructured TIN.
+            # DEM node order is x-fastest (see generate_flat_dem), so the
+            # grid is (rny, rnx) with y on axis 0; queries are (y, x) pairs.
+            if self._dem_grid_axes is None:
+                self._dem_grid_axes = (np.linspace(rg.rectY.min(), rg.rectY.max(), rg.rny),
+                                       np.linspace(rg.rectX.min(), rg.rectX.max(), rg.rnx))
+            interp = RegularGridInterpolator(self._dem_grid_axes,
+                                             known_z.reshape(rg.rny, rg.rnx),
+                                             method='linear',
+                                             bounds_error=False,
+                                             fill_value=np.nan)
+            interpolate_z = interp(interpolate_xy[:, ::-1])
+        else:
+            # Unstructured TIN (e.g. after Badlands has remeshed)
+            known_xy = rg.tinMesh['vertices']  # points that we have known elevation for
+
+            # griddata would rebuild the Delaunay triangulation of the TIN on
+            # every call; instead we cache it and only swap in the new
+            # elevations
+            if self._tin_tri_vertices is not known_xy:
+                self._tin_tri = Delaunay(known_xy)
+                self._tin_tri_vertices = known_xy
+
+            # locate each particle's simplex with qhull's compiled search and
+            # interpolate via the cached barycentric transform; this avoids
+            # constructing a LinearNDInterpolator every tick
+            tri = self._tin_tri
+            simplex = tri.find_simplex(interpolate_xy)
+            inside = simplex >= 0
+
+            T = tri.transform[simplex[inside]]
+            r = interpolate_xy[inside] - T[:, 2]
+            bary = np.einsum('ijk,ik->ij', T[:, :2], r)
+            bary = np.column_stack((bary, 1.0 - bary.sum(axis=1)))
+            corner_z = known_z[tri.simplices[simplex[inside]]]
+
+            # particles outside the TIN get nan, as griddata gave them
+            interpolate_z = np.full(interpolate_xy.shape[0], np.nan)
+            interpolate_z[inside] = np.einsum('ij,ij->i', bary, corner_z)
+
+        return interpolate_z
 
     def load_badlands_dem_file(self, filename):
         self.badlands_model.build_mesh(filename, verbose=False)
 
     def load_badlands_dem_array(self, array):
         # for now, write it out to a temp file and load that into badlands
-        np.savetxt('/tmp/dem.csv', array)
+        # (build_mesh only accepts filenames). %.8g keeps full single-
+        # precision accuracy at roughly a third of the bytes of the savetxt
+        # default '%.18e'.
+        np.savetxt('/tmp/dem.csv', array, fmt='%.8g')
         self.load_badlands_dem_file('/tmp/dem.csv')
 
     def _inject_badlands_displacement(self, time, dt, disp):
@@ -319,22 +577,15 @@ class LinkageModel(object):
         period dt. Injects it into Badlands as 3D tectonic movement.
         """
 
-        # TODO: what does this do? Can it be removed?
-        self.badlands_model.force.merge3d = self.badlands_model.input.Afactor * self.badlands_model.recGrid.resEdges * 0.5
-
         # The Badlands 3D interpolation map is the displacement of each DEM
         # node at the end of the time period relative to its starting position.
         # If you start a new displacement file, it is treated as starting at
         # the DEM starting points (and interpolated onto the TIN as it was at
         # that tNow).
 
-        # kludge; don't keep adding new entries
-        if self._disp_inserted:
-            self.badlands_model.force.T_disp[0, 0] = time
-            self.badlands_model.force.T_disp[0, 1] = (time + dt)
-        else:
-            self.badlands_model.force.T_disp = np.vstack(([time, time + dt], self.badlands_model.force.T_disp))
-            self._disp_inserted = True
+        # rewrite the schedule row preallocated at startup
+        self.badlands_model.force.T_disp[0, 0] = time
+        self.badlands_model.force.T_disp[0, 1] = (time + dt)
 
         self.badlands_model.force.injected_disps = disp
 
@@ -345,54 +596,100 @@ class LinkageModel(object):
         tectonic movement.
         """
 
-        # TODO: what does this do? Can it be removed?
-        self.badlands_model.force.merge3d = self.badlands_model.input.Afactor * self.badlands_model.recGrid.resEdges * 0.5
-
         # The Badlands 3D interpolation map is the displacement of each DEM
         # node at the end of the time period relative to its starting position.
         # If you start a new displacement file, it is treated as starting at
         # the DEM starting points (and interpolated onto the TIN as it was at
         # that tNow).
 
-        # kludge; don't keep adding new entries
-        if self._disp_inserted:
-            self.badlands_model.force.T_disp[0, 0] = time
-            self.badlands_model.force.T_disp[0, 1] = (time + dt)
-        else:
-            self.badlands_model.force.T_disp = np.vstack(([time, time + dt], self.badlands_model.force.T_disp))
-            self._disp_inserted = True
+        # rewrite the schedule row preallocated at startup
+        self.badlands_model.force.T_disp[0, 0] = time
+        self.badlands_model.force.T_disp[0, 1] = (time + dt)
 
         ### gaussian smoothing ###
-        dispX = np.copy(disp[:,0]).reshape(self.badlands_model.recGrid.rnx, self.badlands_model.recGrid.rny)
-        dispY = np.copy(disp[:,1]).reshape(self.badlands_model.recGrid.rnx, self.badlands_model.recGrid.rny)
-        dispZ = np.copy(disp[:,2]).reshape(self.badlands_model.recGrid.rnx, self.badlands_model.recGrid.rny)
-
-        smoothX = gaussian_filter(dispX, sigma)
-        smoothY = gaussian_filter(dispY, sigma)
-        smoothZ = gaussian_filter(dispZ, sigma)
-
-        disp[:,0] = smoothX.reshape(self.badlands_model.recGrid.rnx* self.badlands_model.recGrid.rny)
-        disp[:,1] = smoothY.reshape(self.badlands_model.recGrid.rnx* self.badlands_model.recGrid.rny)
-        disp[:,2] = smoothZ.reshape(self.badlands_model.recGrid.rnx* self.badlands_model.recGrid.rny)
+        # smooth each component in place on a (rnx, rny) view of the
+        # displacement array; no copies needed
+        rnx = self.badlands_model.recGrid.rnx
+        rny = self.badlands_model.recGrid.rny
+        disp3 = disp.reshape(rnx, rny, 3)
+        if sigma > 15:
+            # gaussian_filter's direct convolution cost grows linearly with
+            # sigma; for wide kernels an FFT convolution is cheaper. Pad by
+            # the kernel radius so the boundary behaviour matches
+            # gaussian_filter's default 'reflect' (numpy calls that pad mode
+            # 'symmetric') and sigma is purely a performance knob.
+            kernel = self._gaussian_kernel(sigma).astype(disp3.dtype, copy=False)
+            radius = kernel.shape[0] // 2
+            padded = np.pad(disp3, ((radius, radius), (radius, radius), (0, 0)), mode='symmetric')
+            disp3[...] = fftconvolve(padded, kernel[:, :, None], mode='valid')
+        else:
+            # the three components are independent and gaussian_filter
+            # releases the GIL, so filter them in parallel
+            futures = [_POOL.submit(gaussian_filter, disp3[:, :, k], sigma, output=disp3[:, :, k])
+                       for k in range(3)]
+            for f in futures:
+                f.result()
         ### end gaussian smoothing ###
 
         self.badlands_model.force.injected_disps = disp
 
+    def _gaussian_kernel(self, sigma):
+        """
+        Normalised 2D Gaussian kernel used by the FFT smoothing path, cached
+        per sigma.
+        """
+        if self._gauss_kernel_sigma != sigma:
+            # same truncation as gaussian_filter's default (4 standard
+            # deviations)
+            radius = int(4.0 * sigma + 0.5)
+            x = np.arange(-radius, radius + 1)
+            g = np.exp(-0.5 * (x / sigma) ** 2)
+            g /= g.sum()
+            self._gauss_kernel = np.outer(g, g)
+            self._gauss_kernel_sigma = sigma
+        return self._gauss_kernel
+
     def _update_material_types(self):
         if self.disable_material_changes:
             return
 
+        if numba is not None:
+            # Fused path: compare against the surface and rewrite the
+            # material indices in one parallel pass
+            surface_z = self._interpolate_surface()
+            _classify_particles(self.material_index.data.ravel(),
+                                self.swarm.particleCoordinates.data[:, 2],
+                                surface_z,
+                                self._air_materials,
+                                self._sed_materials,
+                                self.material_map[0][0],
+                                self.material_map[1][0])
+            return
+
         # What do the materials (in air/sediment terms) look like now?
         material_flags = self._determine_particle_state()
 
         # If any materials changed state, update the Underworld material types
-        # TODO(perf): vectorise
         # TODO: update the material_map[1] stuff when we have erodibility layers
-        for index, material in enumerate(self.material_index.data):
-            # convert air to sediment
-            if int(material) in self.material_map[0] and material_flags[index]:
-                self.material_index.data[index] = self.material_map[1][0]
-
-            # convert sediment to air
-            if int(material) in self.material_map[1] and not material_flags[index]:
-                self.material_index.data[index] = self.material_map[0][0]
+        mat = self.material_index.data.ravel()
+        if mat.size == 0:
+            # this rank holds no particles
+            return
+
+        # O(1) membership lookups indexed by material type; the tables are
+        # sized to cover every index we've seen
+        if self._is_air is None or mat.max() >= self._is_air.shape[0]:
+            size = int(max(self._air_materials.max(), self._sed_materials.max(), mat.max())) + 1
+            self._is_air = np.zeros(size, dtype=bool)
+            self._is_air[self._air_materials] = True
+            self._is_sed = np.zeros(size, dtype=bool)
+            self._is_sed[self._sed_materials] = True
+
+        air_mask = self._is_air[mat]
+        sed_mask = self._is_sed[mat]
+
+        # convert air to sediment
+        mat[air_mask & material_flags] = self.material_map[1][0]
+
+        # convert sediment to air
+        mat[sed_mask & ~material_flags] = self.material_map[0][0]